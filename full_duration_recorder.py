@@ -4,9 +4,9 @@ Full Duration Audio Recorder - Saves complete 10 second recordings
 """
 
 import asyncio
-import struct
 import wave
 import os
+import time
 import numpy as np
 from bleak import BleakClient, BleakScanner
 from datetime import datetime
@@ -15,33 +15,93 @@ from datetime import datetime
 AUDIO_SERVICE_UUID = "12345678-1234-5678-1234-567812345678"
 AUDIO_DATA_CHAR_UUID = "12345679-1234-5678-1234-567812345678"
 
+# Firmware sends 160 int16 samples per notification
+AUDIO_PACKET_SIZE = 320
+SAMPLE_RATE = 16000  # Nominal mic rate, used to size the capture buffer
+
+# Last connected device (shared with auto_pitch_recorder), tried before a full scan
+DEVICE_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "xiao_ble.addr")
+
+def load_cached_address():
+    """Return the last connected device address, or None"""
+    try:
+        with open(DEVICE_CACHE_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def save_cached_address(address):
+    """Remember the device address for the next run"""
+    try:
+        os.makedirs(os.path.dirname(DEVICE_CACHE_FILE), exist_ok=True)
+        with open(DEVICE_CACHE_FILE, 'w') as f:
+            f.write(address)
+    except OSError as e:
+        print(f"⚠️ Could not cache device address: {e}")
+
 class FullDurationRecorder:
     def __init__(self):
         self.client = None
         self.device_address = None
-        self.audio_samples = []
+        # Preallocated int16 capture buffer and write cursor, sized in record()
+        self._buf = np.empty(0, dtype=np.int16)
+        self._n = 0
+        # Per-packet (arrival time, running sample count) rows for the rate fit
+        self._arrivals = np.empty((0, 2))
+        self._n_arrivals = 0
         self.packet_count = 0
         self.recording = False
+        # time.monotonic() timestamps of the recording window
         self.start_time = None
+        self.end_time = None
+        self._last_progress = 0.0
         
     async def connect(self):
         """Find and connect to MicStreamer"""
-        print("🔍 Scanning for MicStreamer...")
-        devices = await BleakScanner.discover(timeout=5)
+        def is_audio_device(device, adv):
+            name = (adv and adv.local_name) or device.name
+            return bool(name) and ("MicStreamer" in name or "AudioStreamer" in name or "Xiao Audio Controller" in name)
+        
+        device = None
         
-        for device in devices:
-            if device.name and ("MicStreamer" in device.name or "AudioStreamer" in device.name or "Xiao Audio Controller" in device.name):
-                print(f"✅ Found: {device.name}")
-                self.device_address = device.address
-                break
+        # Look for the last device first - this returns as soon as it advertises.
+        # The cache is shared with auto_pitch_recorder, so it still has to pass the name filter.
+        cached_address = load_cached_address()
+        if cached_address:
+            print(f"🔍 Looking for last device {cached_address}...")
+            device = await BleakScanner.find_device_by_address(cached_address, timeout=3.0)
+            if device and not is_audio_device(device, None):
+                device = None
+        
+        if not device:
+            print("🔍 Scanning for MicStreamer...")
+            
+            # Stop scanning at the first matching advertisement rather than after the full 5 s
+            device = await BleakScanner.find_device_by_filter(is_audio_device, timeout=5)
+            if not device:
+                print("❌ Audio device not found")
+                return False
         
-        if not self.device_address:
-            print("❌ Audio device not found")
-            return False
+        print(f"✅ Found: {device.name}")
+        self.device_address = device.address
         
-        self.client = BleakClient(self.device_address)
+        self.client = BleakClient(device)
         await self.client.connect()
         print("✅ Connected")
+        save_cached_address(self.device_address)
+        
+        # BlueZ reports the default 23-byte MTU until the exchange is forced
+        if self.client._backend.__class__.__name__ == "BleakClientBlueZDBus":
+            try:
+                await self.client._backend._acquire_mtu()
+            except Exception as e:
+                print(f"⚠️ MTU exchange failed: {e}")
+        
+        # An audio packet has to fit in the MTU minus the 3-byte ATT header
+        mtu = self.client.mtu_size
+        print(f"📡 MTU: {mtu} bytes")
+        if mtu - 3 < AUDIO_PACKET_SIZE:
+            print(f"⚠️ MTU too small for {AUDIO_PACKET_SIZE}-byte audio packets - expect dropped audio")
         return True
     
     def audio_handler(self, sender, data):
@@ -51,26 +111,47 @@ class FullDurationRecorder:
             
         self.packet_count += 1
         
-        # Interpret as little-endian int16_t samples
-        if len(data) >= 2 and len(data) % 2 == 0:
-            samples = struct.unpack(f'<{len(data)//2}h', data)
-            self.audio_samples.extend(samples)
-            
-            # Show progress every 100 packets
-            if self.packet_count % 100 == 0:
-                elapsed = (datetime.now() - self.start_time).total_seconds()
-                current_rate = len(self.audio_samples) / elapsed
-                print(f"📦 {self.packet_count} packets, {len(self.audio_samples)} samples, "
-                      f"Rate: {current_rate:.0f} Hz")
+        # Firmware sends whole int16 samples; drop anything with a stray byte
+        n_bytes = len(data)
+        if n_bytes & 1:
+            return
+        
+        # Interpret as little-endian int16_t samples (zero-copy view)
+        samples = np.frombuffer(data, dtype='<i2')
+        n = samples.size
+        
+        # Copy into the capture buffer, growing it only on overflow
+        if self._n + n > self._buf.size:
+            self._buf = np.resize(self._buf, max(self._buf.size * 2, self._n + n))
+        self._buf[self._n:self._n + n] = samples
+        self._n += n
+        
+        now = time.monotonic()
+        if self._n_arrivals == len(self._arrivals):
+            self._arrivals = np.resize(self._arrivals, (max(len(self._arrivals) * 2, 64), 2))
+        self._arrivals[self._n_arrivals] = (now, self._n)
+        self._n_arrivals += 1
+        
+        # Show progress at most once per second
+        if now - self._last_progress >= 1.0:
+            self._last_progress = now
+            elapsed = now - self.start_time
+            current_rate = self._n / elapsed
+            print(f"📦 {self.packet_count} packets, {self._n} samples, "
+                  f"Rate: {current_rate:.0f} Hz")
     
     async def record(self, duration=10):
         """Record audio for specified duration"""
         print(f"🎵 Recording for {duration} seconds...")
         
-        # Reset recording state
-        self.audio_samples = []
+        # Reset recording state, with headroom for BLE rate jitter
+        self._buf = np.empty(int(duration * SAMPLE_RATE * 1.5), dtype=np.int16)
+        self._n = 0
+        self._arrivals = np.empty((int(duration * SAMPLE_RATE * 1.5) // (AUDIO_PACKET_SIZE // 2), 2))
+        self._n_arrivals = 0
         self.packet_count = 0
-        self.start_time = datetime.now()
+        self.start_time = time.monotonic()
+        self._last_progress = self.start_time
         
         # Start notifications
         await self.client.start_notify(AUDIO_DATA_CHAR_UUID, self.audio_handler)
@@ -84,15 +165,16 @@ class FullDurationRecorder:
         # Stop recording
         self.recording = False
         await self.client.stop_notify(AUDIO_DATA_CHAR_UUID)
+        self.end_time = time.monotonic()
         
-        elapsed = (datetime.now() - self.start_time).total_seconds()
+        elapsed = self.end_time - self.start_time
         print(f"🛑 Recording stopped after {elapsed:.1f}s")
         
-        return len(self.audio_samples) > 0
+        return self._n > 0
     
     def save_full_duration_audio(self, filename=None):
         """Save audio to get FULL 10 second duration"""
-        if not self.audio_samples:
+        if not self._n:
             print("❌ No audio to save")
             return None
         
@@ -100,32 +182,43 @@ class FullDurationRecorder:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"xiao_full_{timestamp}.wav"
         
-        # Calculate the actual BLE streaming rate
-        elapsed = (datetime.now() - self.start_time).total_seconds()
-        actual_ble_rate = int(len(self.audio_samples) / elapsed)
+        # Calculate the actual BLE streaming rate over the recording window
+        elapsed = self.end_time - self.start_time
+        actual_ble_rate = int(self._n / elapsed)
+        
+        # Prefer the slope of samples vs arrival time: unlike samples / elapsed it
+        # isn't skewed by the gap before the first packet or after the last
+        arrivals = self._arrivals[:self._n_arrivals]
+        if self._n_arrivals >= 2 and arrivals[-1, 0] - arrivals[0, 0] >= 1.0:
+            slope, _ = np.polyfit(arrivals[:, 0] - arrivals[0, 0], arrivals[:, 1], 1)
+            actual_ble_rate = int(round(slope))
         
         # Use the ACTUAL BLE rate so file duration = recording duration
         save_sample_rate = actual_ble_rate
         
-        # Convert to numpy array
-        audio_array = np.array(self.audio_samples, dtype=np.int16)
+        # View of the captured samples (no copy)
+        audio_array = self._buf[:self._n]
         
         print(f"\n📊 FULL DURATION ANALYSIS:")
-        print(f"   Total samples: {len(self.audio_samples):,}")
+        print(f"   Total samples: {self._n:,}")
         print(f"   Recording time: {elapsed:.2f}s")
         print(f"   BLE streaming rate: {actual_ble_rate} Hz")
         print(f"   Saving at: {save_sample_rate} Hz (for full duration)")
         
         # Calculate playback duration
-        playback_duration = len(self.audio_samples) / save_sample_rate
+        playback_duration = self._n / save_sample_rate
         print(f"   Playback duration: {playback_duration:.2f}s (FULL DURATION!)")
         
-        # Audio quality
+        # Audio quality - one reduction per statistic, squares summed as int64
+        # (einsum casts in small blocks, so no full-size float/squared copies)
+        min_val, max_val = int(audio_array.min()), int(audio_array.max())
+        sum_sq = np.einsum('i,i->', audio_array, audio_array, dtype=np.int64)
+        rms = np.sqrt(sum_sq / len(audio_array))
         print(f"\n🎵 Audio quality:")
-        print(f"   Min: {np.min(audio_array)}, Max: {np.max(audio_array)}")
-        print(f"   Mean: {np.mean(audio_array):.1f}")
-        print(f"   RMS: {np.sqrt(np.mean(audio_array.astype(np.float32)**2)):.1f}")
-        print(f"   Dynamic range: {np.max(audio_array) - np.min(audio_array)}")
+        print(f"   Min: {min_val}, Max: {max_val}")
+        print(f"   Mean: {audio_array.mean():.1f}")
+        print(f"   RMS: {rms:.1f}")
+        print(f"   Dynamic range: {max_val - min_val}")
         
         try:
             # Create WAV file with ACTUAL BLE rate for full duration
@@ -133,7 +226,7 @@ class FullDurationRecorder:
                 wav.setnchannels(1)        # Mono
                 wav.setsampwidth(2)        # 16-bit
                 wav.setframerate(save_sample_rate)  # Use actual BLE rate
-                wav.writeframes(audio_array.tobytes())
+                wav.writeframes(audio_array)  # ndarray exposes the buffer protocol, no copy
             
             file_size = os.path.getsize(filename)
             
@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 """
-Auto Pitch Recorder with Rubber Band Processing
-Automatically records BLE audio and applies +2 semitone pitch correction using Rubber Band.
+Auto Pitch Recorder with librosa / Rubber Band Processing
+Automatically records BLE audio and applies +2 semitone pitch correction.
 
 Features:
 - Automatic BLE connection to AudioStreamer/MicStreamer
 - Real-time audio recording 
-- Automatic Rubber Band pitch correction (+2 semitones)
+- Automatic pitch correction (+2 semitones), in-process with librosa
+  or via Rubber Band when librosa is not installed
 - Professional DAW-quality processing
 - One-click operation
 """
@@ -53,35 +54,75 @@ CHUNK_SIZE = 320     # 160 samples * 2 bytes = 320 bytes per BLE packet
 # Pitch Configuration
 PITCH_SEMITONES = 2.0  # +2 semitones higher pitch
 
+# Last connected device, tried before a full scan on the next run
+DEVICE_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "xiao_ble.addr")
+
+def load_cached_address():
+    """Return the last connected device address, or None"""
+    try:
+        with open(DEVICE_CACHE_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def save_cached_address(address):
+    """Remember the device address for the next run"""
+    try:
+        os.makedirs(os.path.dirname(DEVICE_CACHE_FILE), exist_ok=True)
+        with open(DEVICE_CACHE_FILE, 'w') as f:
+            f.write(address)
+    except OSError as e:
+        print(f"⚠️ Could not cache device address: {e}")
+
 class AutoPitchRecorder:
     def __init__(self, device_name="AudioStreamer", recording_duration=10):
         self.device_name = device_name
         self.recording_duration = recording_duration
         self.client = None
-        self.audio_data = []
+        # Preallocated int16 capture buffer (with headroom for BLE rate jitter)
+        self._buf = np.empty(int(SAMPLE_RATE * recording_duration * 1.5), dtype=np.int16)
+        self._n = 0
         self.is_recording = False
         self.start_time = None
+        self._last_progress = 0.0
         self.packet_count = 0
+        # librosa runs in-process; pyrubberband shells out to the rubberband CLI
+        self.pitch_engine = "librosa" if LIBROSA_AVAILABLE else "Rubber Band"
         
         print(f"🎤 Auto Pitch Recorder initialized")
         print(f"🎵 Target pitch correction: +{PITCH_SEMITONES} semitones")
         print(f"⏱️ Recording duration: {recording_duration} seconds")
         
-        if not RUBBERBAND_AVAILABLE:
-            print("❌ Rubber Band not available. Install with: pip install pyrubberband")
+        if not (LIBROSA_AVAILABLE or RUBBERBAND_AVAILABLE):
+            print("❌ No pitch shifter available. Install with: pip install librosa")
             exit(1)
 
     async def find_device(self):
         """Scan for the BLE audio device"""
-        print("🔍 Scanning for BLE devices...")
-        devices = await BleakScanner.discover(timeout=10.0)
+        def matches(name):
+            name = (name or '').lower()
+            return self.device_name.lower() in name or "audiostreamer" in name or "micstreamer" in name
         
-        for device in devices:
-            name = getattr(device, 'name', None) or 'Unknown'
-            if self.device_name.lower() in name.lower() or "audiostreamer" in name.lower() or "micstreamer" in name.lower():
-                print(f"✅ Found device: {name} ({device.address})")
+        # Look for the last device first - this returns as soon as it advertises.
+        # The cache is shared with other scripts, so it still has to match our name filter.
+        cached_address = load_cached_address()
+        if cached_address:
+            print(f"🔍 Looking for last device {cached_address}...")
+            device = await BleakScanner.find_device_by_address(cached_address, timeout=3.0)
+            if device and matches(device.name):
+                print(f"✅ Found device: {device.name} ({device.address})")
                 return device
         
+        print("🔍 Scanning for BLE devices...")
+        
+        # Stops scanning at the first matching advertisement instead of waiting out the timeout
+        device = await BleakScanner.find_device_by_filter(
+            lambda device, adv: matches(adv.local_name or device.name), timeout=10.0
+        )
+        if device:
+            print(f"✅ Found device: {device.name} ({device.address})")
+            return device
+        
         print(f"❌ Device '{self.device_name}' not found")
         return None
 
@@ -94,14 +135,19 @@ class AutoPitchRecorder:
         
         # Convert bytes to int16 samples (little-endian)
         samples = np.frombuffer(data, dtype=np.int16)
+        n = samples.size
         
-        # Add to recording buffer
-        self.audio_data.extend(samples)
+        # Copy into the capture buffer, growing it only on overflow
+        if self._n + n > self._buf.size:
+            self._buf = np.resize(self._buf, max(self._buf.size * 2, self._n + n))
+        self._buf[self._n:self._n + n] = samples
+        self._n += n
         
-        # Progress update
-        if self.packet_count % 100 == 0:
-            elapsed = time.time() - self.start_time
-            print(f"📦 Received {self.packet_count} packets in {elapsed:.1f}s")
+        # Progress update, at most once per second
+        now = time.perf_counter()
+        if now - self._last_progress >= 1.0:
+            self._last_progress = now
+            print(f"📦 Received {self.packet_count} packets in {now - self.start_time:.1f}s")
 
     async def connect_and_setup(self, device):
         """Connect to device and setup audio notifications"""
@@ -111,7 +157,20 @@ class AutoPitchRecorder:
         await self.client.connect()
         
         print("✅ Connected! Setting up audio notifications...")
-        
+
+        # BlueZ reports the default 23-byte MTU until the exchange is forced
+        if self.client._backend.__class__.__name__ == "BleakClientBlueZDBus":
+            try:
+                await self.client._backend._acquire_mtu()
+            except Exception as e:
+                print(f"⚠️ MTU exchange failed: {e}")
+
+        # An audio packet has to fit in the MTU minus the 3-byte ATT header
+        mtu = self.client.mtu_size
+        print(f"📡 Negotiated MTU: {mtu} bytes")
+        if mtu - 3 < CHUNK_SIZE:
+            print(f"⚠️ MTU too small for {CHUNK_SIZE}-byte audio packets - expect dropped audio")
+
         # Enable notifications on audio characteristic
         await self.client.start_notify(AUDIO_CHAR_UUID, self.audio_notification_handler)
         print("🎤 Audio notifications enabled")
@@ -122,27 +181,28 @@ class AutoPitchRecorder:
         """Record audio for specified duration"""
         print(f"🎵 Starting {self.recording_duration}s recording...")
         
-        self.audio_data = []
+        self._n = 0
         self.packet_count = 0
         self.is_recording = True
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
+        self._last_progress = self.start_time
         
         # Record for specified duration
         await asyncio.sleep(self.recording_duration)
         
         self.is_recording = False
-        actual_duration = time.time() - self.start_time
+        actual_duration = time.perf_counter() - self.start_time
         
         print(f"✅ Recording complete!")
         print(f"📊 Duration: {actual_duration:.2f}s")
         print(f"📦 Packets: {self.packet_count}")
         print(f"📈 Rate: {self.packet_count/actual_duration:.1f} packets/sec")
         
-        return np.array(self.audio_data, dtype=np.int16), actual_duration
+        return self._buf[:self._n], actual_duration
 
     def apply_rubberband_pitch_correction(self, audio_data, actual_duration):
-        """Apply Rubber Band pitch correction (+2 semitones)"""
-        print(f"🎵 Applying Rubber Band pitch correction (+{PITCH_SEMITONES} semitones)...")
+        """Apply pitch correction (+2 semitones) with librosa or Rubber Band"""
+        print(f"🎵 Applying {self.pitch_engine} pitch correction (+{PITCH_SEMITONES} semitones)...")
         
         # Calculate actual sample rate from streaming
         calculated_rate = len(audio_data) / actual_duration
@@ -156,22 +216,43 @@ class AutoPitchRecorder:
             print(f"📊 Using calculated sample rate: {process_rate} Hz")
         
         # Convert int16 to float32 for processing
-        audio_float = audio_data.astype(np.float32) / 32768.0
+        audio_float = np.multiply(audio_data, np.float32(1.0 / 32768.0), dtype=np.float32)
         
-        # Apply Rubber Band pitch shifting
-        try:
-            shifted = pyrb.pitch_shift(audio_float, process_rate, n_steps=PITCH_SEMITONES)
-            print("✅ Rubber Band pitch correction applied successfully!")
-            
-            # Convert back to int16
-            result = (shifted * 32767).astype(np.int16)
-            
-            return result, process_rate
-            
-        except Exception as e:
-            print(f"❌ Rubber Band processing error: {e}")
+        # Apply pitch shifting
+        shifted = None
+        if self.pitch_engine == "librosa":
+            try:
+                shifted = librosa.effects.pitch_shift(
+                    audio_float,
+                    sr=process_rate,
+                    n_steps=PITCH_SEMITONES,
+                    res_type='soxr_hq'  # soxr is librosa's fastest resampler (librosa >= 0.10)
+                )
+            except Exception as e:
+                print(f"❌ librosa processing error: {e}")
+                if RUBBERBAND_AVAILABLE:
+                    print("🔄 Falling back to Rubber Band")
+                    self.pitch_engine = "Rubber Band"
+        
+        if shifted is None and self.pitch_engine == "Rubber Band":
+            try:
+                shifted = pyrb.pitch_shift(audio_float, process_rate, n_steps=PITCH_SEMITONES)
+            except Exception as e:
+                print(f"❌ Rubber Band processing error: {e}")
+        
+        if shifted is None:
             print("🔄 Falling back to original audio")
             return audio_data, process_rate
+        
+        print(f"✅ {self.pitch_engine} pitch correction applied successfully!")
+        
+        # Convert back to int16 (same 32768 scale both ways); the phase vocoder can
+        # overshoot full scale, so clip rather than let peaks wrap around
+        result = np.multiply(shifted, 32768.0, dtype=np.float32)
+        np.clip(result, -32768, 32767, out=result)
+        result = result.astype(np.int16)
+        
+        return result, process_rate
 
     def save_wav(self, audio_data, sample_rate, filename=None):
         """Save processed audio to WAV file"""
@@ -184,7 +265,7 @@ class AutoPitchRecorder:
             wav_file.setnchannels(CHANNELS)
             wav_file.setsampwidth(SAMPLE_WIDTH)
             wav_file.setframerate(sample_rate)
-            wav_file.writeframes(audio_data.tobytes())
+            wav_file.writeframes(audio_data)  # ndarray exposes the buffer protocol, no copy
         
         file_size = os.path.getsize(filename)
         duration = len(audio_data) / sample_rate
@@ -193,7 +274,7 @@ class AutoPitchRecorder:
         print(f"📊 File size: {file_size/1024:.1f} KB")
         print(f"📊 Duration: {duration:.2f} seconds")
         print(f"📊 Sample rate: {sample_rate} Hz")
-        print(f"🎵 Pitch correction: +{PITCH_SEMITONES} semitones (Rubber Band)")
+        print(f"🎵 Pitch correction: +{PITCH_SEMITONES} semitones ({self.pitch_engine})")
         
         return filename
 
@@ -212,16 +293,22 @@ class AutoPitchRecorder:
                 return None
             
             await self.connect_and_setup(device)
+            save_cached_address(device.address)
             
             # Record audio
             audio_data, actual_duration = await self.record_audio()
             
             if len(audio_data) > 0:
-                # Apply Rubber Band pitch correction
-                processed_audio, sample_rate = self.apply_rubberband_pitch_correction(audio_data, actual_duration)
-                
+                # Pitch correction and disk I/O block, so run them off the event loop
+                loop = asyncio.get_running_loop()
+
+                # Apply pitch correction
+                processed_audio, sample_rate = await loop.run_in_executor(
+                    None, self.apply_rubberband_pitch_correction, audio_data, actual_duration
+                )
+
                 # Save processed audio
-                filename = self.save_wav(processed_audio, sample_rate)
+                filename = await loop.run_in_executor(None, self.save_wav, processed_audio, sample_rate)
                 
                 print(f"🎉 SUCCESS! Auto pitch recording complete: {filename}")
                 return filename
@@ -240,19 +327,19 @@ class AutoPitchRecorder:
 
 async def main():
     """Main function - one-click auto pitch recording"""
-    print("=== Auto Pitch Recorder with Rubber Band ===")
+    print("=== Auto Pitch Recorder with librosa / Rubber Band ===")
     print("Automatically records BLE audio and applies +2 semitone pitch correction")
     print()
     
     # Check dependencies
-    if not RUBBERBAND_AVAILABLE:
-        print("❌ Rubber Band not available!")
-        print("Install with: pip install pyrubberband")
+    if not (LIBROSA_AVAILABLE or RUBBERBAND_AVAILABLE):
+        print("❌ No pitch shifter available!")
+        print("Install with: pip install librosa (or pip install pyrubberband)")
         return
     
     if not LIBROSA_AVAILABLE:
         print("⚠️ Librosa not available. Install with: pip install librosa")
-        print("Continuing without librosa...")
+        print("Continuing with Rubber Band...")
     
     # Create recorder with 10-second default recording
     recorder = AutoPitchRecorder(recording_duration=10)
@@ -262,7 +349,7 @@ async def main():
     
     if result:
         print(f"\n🎵 FINAL RESULT: {result}")
-        print("✅ Professional Rubber Band pitch correction applied!")
+        print(f"✅ {recorder.pitch_engine} pitch correction applied!")
         print("🎤 Ready to play - audio is pitched up by 2 semitones!")
     else:
         print("\n❌ Auto pitch recording failed")
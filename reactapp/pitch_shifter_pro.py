@@ -10,18 +10,24 @@ Requirements:
 - soundfile: for reading/writing audio files
 - numpy: for numerical operations
 - pyrubberband: for professional DAW-quality results (optional)
+- torch + torchaudio: for GPU pitch shifting of large batches (optional)
 
 Usage:
-    python pitch_shifter_pro.py input.wav output.wav semitones [--method METHOD]
+    python pitch_shifter_pro.py input.wav output.wav semitones [--method METHOD] [--jobs N]
     
 Example:
     python pitch_shifter_pro.py input.wav output.wav 2 --method librosa
     python pitch_shifter_pro.py input.wav output.wav -3 --method rubberband
+    python pitch_shifter_pro.py input.wav output.wav 2 --method torch
+    python pitch_shifter_pro.py long.wav output.wav 2 --jobs 4
 """
 
 import argparse
 import sys
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
 import numpy as np
 
 try:
@@ -40,22 +46,47 @@ try:
 except ImportError:
     RUBBERBAND_AVAILABLE = False
 
+# Check for optional torchaudio (runs on CUDA when available)
+try:
+    import torch
+    import torchaudio
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+
+# Resampler used by librosa for each quality preset. pitch_shift resamples from
+# sr / 2**(-n_steps/12), which is not a whole number, so 'polyphase' can't be used here.
+RESAMPLE_QUALITY = {
+    'fast': 'soxr_qq',     # SoX quick-quality, lowest latency
+    'hq': 'soxr_hq',       # SoX resampler, near kaiser_best quality
+    'best': 'kaiser_best'  # Highest quality resampling
+}
 
-def pitch_shift_librosa(audio_data, sr, semitones):
+
+def pitch_shift_librosa(audio_data, sr, semitones, quality='best'):
     """
     High-quality pitch shifting using librosa's advanced algorithm.
     Optimized for BLE audio streams and minimal artifacts.
+    
+    quality selects the resampler: 'fast', 'hq' or 'best' (see RESAMPLE_QUALITY).
     """
     if semitones == 0:
         return audio_data
     
+    # Scale the STFT to the input: n_fft = 4 * hop never exceeds the input length, so
+    # short BLE chunks (160 samples -> hop 32, n_fft 128) aren't padded out to a full frame.
+    # Anything from 2048 samples up gets the usual 512 / 2048.
+    hop_length = int(min(512, 2 ** int(np.log2(max(len(audio_data) // 4, 16)))))
+    
     # Use librosa's sophisticated phase vocoder with harmonic-percussive separation
     shifted = librosa.effects.pitch_shift(
         audio_data, 
         sr=sr, 
         n_steps=semitones,
-        hop_length=512,  # Good balance of quality and speed
-        res_type='kaiser_best'  # Highest quality resampling
+        n_fft=4 * hop_length,  # Keep librosa's default 75% overlap
+        hop_length=hop_length,
+        res_type=RESAMPLE_QUALITY[quality]
     )
     return shifted
 
@@ -76,7 +107,120 @@ def pitch_shift_rubberband(audio_data, sr, semitones):
     return shifted
 
 
-def pitch_shift_ble_audio(audio_data, semitones=0, method='librosa'):
+def pitch_shift_torch(audio_data, sr, semitones, device=None):
+    """
+    Phase vocoder pitch shifting with torchaudio, on the GPU when available.
+    Same STFT approach as librosa, but the FFTs run on cuFFT.
+    """
+    if not TORCH_AVAILABLE:
+        raise ImportError("torchaudio not installed. Install with: pip install torch torchaudio")
+    
+    if semitones == 0:
+        return audio_data
+    
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    
+    n = len(audio_data)
+    n_fft, hop_length = 2048, 512
+    waveform = torch.from_numpy(np.ascontiguousarray(audio_data, dtype=np.float32)).to(device)
+    
+    # torchaudio.functional.pitch_shift resamples int(sr/rate) -> sr, which at 16 kHz is a
+    # coprime pair (17959 -> 16000) and builds a huge sinc kernel. Approximate the stretch
+    # rate with a small fraction instead (under 1 cent of error for +-24 semitones) so the
+    # resampling kernel stays at a few million taps at most.
+    rate = Fraction(2 ** (-semitones / 12)).limit_denominator(1000)
+    
+    with torch.no_grad():
+        window = torch.hann_window(n_fft, device=device)
+        # Zero padding like librosa: reflect padding starts the phase vocoder with per-bin
+        # phases out of step, and the output partly cancels for every upward shift
+        spec = torch.stft(waveform, n_fft, hop_length, window=window,
+                          pad_mode='constant', return_complex=True)
+        phase_advance = torch.linspace(0, np.pi * hop_length, spec.shape[-2], device=device)[..., None]
+        stretched = torchaudio.functional.phase_vocoder(spec, float(rate), phase_advance)
+        stretched = torch.istft(stretched, n_fft, hop_length, window=window,
+                                length=int(round(n / float(rate))))
+        
+        # Resample by rate = numerator/denominator to restore the original length
+        shifted = torchaudio.functional.resample(stretched, rate.denominator, rate.numerator)
+    
+    return librosa.util.fix_length(shifted.cpu().numpy(), size=n)
+
+
+def _pitch_shift_segment(args):
+    """
+    Worker for pitch_shift_parallel (module level so it can be pickled).
+    """
+    audio_data, sr, semitones, method = args
+    if method == 'rubberband':
+        return pitch_shift_rubberband(audio_data, sr, semitones)
+    if method == 'torch':
+        return pitch_shift_torch(audio_data, sr, semitones)
+    return pitch_shift_librosa(audio_data, sr, semitones)
+
+
+def pitch_shift_parallel(audio_data, sr, semitones, method='librosa', jobs=2,
+                         chunk_seconds=30.0, overlap_seconds=1.0):
+    """
+    Pitch shift long audio by processing overlapping chunks in parallel.
+    
+    Each chunk is shifted in its own process and neighbouring chunks are
+    joined with a raised-cosine crossfade across the overlap.
+    
+    Args:
+        audio_data: Audio data as float32
+        sr: Sample rate
+        semitones: Number of semitones to shift
+        method: 'librosa', 'rubberband' or 'torch'
+        jobs: Number of worker processes
+        chunk_seconds: Length of each chunk before overlap
+        overlap_seconds: Length of the crossfade between chunks
+    """
+    n = len(audio_data)
+    chunk = int(chunk_seconds * sr)
+    overlap = int(overlap_seconds * sr)
+    
+    if jobs <= 1 or n <= chunk + overlap:
+        return _pitch_shift_segment((audio_data, sr, semitones, method))
+    
+    # Chunk i covers [i*chunk, (i+1)*chunk + overlap), so neighbours share `overlap` samples.
+    # Stopping before n - overlap keeps the last chunk from lying entirely inside the previous overlap.
+    starts = list(range(0, n - overlap, chunk))
+    lengths = [min(n, start + chunk + overlap) - start for start in starts]
+    segments = [audio_data[start:start + length] for start, length in zip(starts, lengths)]
+    
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        shifted = list(pool.map(_pitch_shift_segment,
+                                [(seg, sr, semitones, method) for seg in segments]))
+    
+    # Raised-cosine fades across the overlap; fade_in + fade_out == 1
+    fade_in = (0.5 - 0.5 * np.cos(np.pi * np.arange(overlap) / max(overlap, 1))).astype(np.float32)
+    fade_out = 1.0 - fade_in
+    
+    output = np.zeros(n, dtype=np.float32)
+    for i, (start, length, seg) in enumerate(zip(starts, lengths, shifted)):
+        # Shifters can return a few samples more or less; the fades assume the exact chunk length
+        seg = librosa.util.fix_length(np.asarray(seg, dtype=np.float32), size=length).copy()
+        
+        # Fade in over the region shared with the previous chunk
+        if i > 0:
+            seg[:overlap] *= fade_in
+        
+        # Fade out over the region shared with the next chunk
+        if i + 1 < len(starts):
+            seg[length - overlap:] *= fade_out
+        
+        output[start:start + len(seg)] += seg
+    
+    return output
+
+
+# Per-thread float32 scratch buffer for pitch_shift_ble_audio, replaced when the chunk size changes
+_scratch = threading.local()
+
+
+def pitch_shift_ble_audio(audio_data, semitones=0, method='librosa', quality='fast'):
     """
     Process audio chunks from nRF52840 BLE stream.
     Optimized for 16kHz audio streams.
@@ -85,10 +229,19 @@ def pitch_shift_ble_audio(audio_data, semitones=0, method='librosa'):
         audio_data: Audio data as int16 or float32
         semitones: Number of semitones to shift
         method: 'librosa' or 'rubberband'
+        quality: librosa resampler preset - 'fast', 'hq' or 'best'
     """
-    # Convert int16 to float32 if needed
+    # Pass-through: no conversion needed when there is nothing to shift
+    if semitones == 0:
+        return audio_data
+    
+    # Convert int16 to float32 if needed, reusing the scratch buffer for this chunk size
     if audio_data.dtype == np.int16:
-        audio_float = audio_data.astype(np.float32) / 32768.0
+        n = len(audio_data)
+        buf = getattr(_scratch, 'buf', None)
+        if buf is None or len(buf) != n:
+            buf = _scratch.buf = np.empty(n, dtype=np.float32)
+        audio_float = np.multiply(audio_data, np.float32(1.0 / 32768.0), out=buf, dtype=np.float32)
     else:
         audio_float = audio_data
     
@@ -96,16 +249,19 @@ def pitch_shift_ble_audio(audio_data, semitones=0, method='librosa'):
     if method == 'rubberband':
         shifted = pitch_shift_rubberband(audio_float, 16000, semitones)
     else:  # default to librosa
-        shifted = pitch_shift_librosa(audio_float, 16000, semitones)
+        shifted = pitch_shift_librosa(audio_float, 16000, semitones, quality)
     
-    # Convert back to int16 if original was int16
+    # Convert back to int16 if original was int16 (same 32768 scale both ways)
     if audio_data.dtype == np.int16:
-        return (shifted * 32767).astype(np.int16)
+        out = buf if len(shifted) == n else np.empty(len(shifted), dtype=np.float32)
+        np.multiply(shifted, 32768.0, out=out)
+        np.clip(out, -32768, 32767, out=out)
+        return out.astype(np.int16)
     else:
         return shifted
 
 
-def pitch_shift_audio(input_file, output_file, semitones, method='librosa'):
+def pitch_shift_audio(input_file, output_file, semitones, method='librosa', jobs=1):
     """
     Pitch shift an audio file using professional methods.
     
@@ -113,12 +269,19 @@ def pitch_shift_audio(input_file, output_file, semitones, method='librosa'):
         input_file (str): Path to input WAV file
         output_file (str): Path to output WAV file
         semitones (float): Number of semitones to shift
-        method (str): 'librosa' or 'rubberband'
+        method (str): 'librosa', 'rubberband' or 'torch'
+        jobs (int): Worker processes for long files (1 = process in one piece)
     """
     try:
         # Load the audio file
         print(f"Loading audio file: {input_file}")
-        y, sr = librosa.load(input_file, sr=None)
+        if not os.path.isfile(input_file):
+            raise FileNotFoundError(input_file)
+        
+        # Direct libsndfile read at the native rate (librosa.load adds a resample pass and copy)
+        y, sr = sf.read(input_file, dtype='float32')
+        if y.ndim > 1:
+            y = y.mean(axis=1, dtype=np.float32)  # Downmix to mono like librosa.load
         print(f"Sample rate: {sr} Hz")
         print(f"Duration: {len(y) / sr:.2f} seconds")
         
@@ -129,19 +292,28 @@ def pitch_shift_audio(input_file, output_file, semitones, method='librosa'):
         # Apply pitch shifting
         print(f"Processing audio using '{method}' method...")
         
-        if method == 'rubberband':
-            if not RUBBERBAND_AVAILABLE:
-                print("Warning: pyrubberband not available, falling back to librosa")
-                method = 'librosa'
-            else:
-                y_shifted = pitch_shift_rubberband(y, sr, semitones)
+        if method == 'rubberband' and not RUBBERBAND_AVAILABLE:
+            print("Warning: pyrubberband not available, falling back to librosa")
+            method = 'librosa'
+        
+        if method == 'torch' and not TORCH_AVAILABLE:
+            print("Warning: torchaudio not available, falling back to librosa")
+            method = 'librosa'
+        
+        # The GPU already processes the whole file at once; worker processes would fight over it
+        if method == 'torch' and jobs > 1:
+            print("Note: --jobs is ignored with the torch method")
+            jobs = 1
         
-        if method == 'librosa':
-            y_shifted = pitch_shift_librosa(y, sr, semitones)
+        if jobs > 1:
+            print(f"Using {jobs} worker processes")
+        y_shifted = pitch_shift_parallel(y, sr, semitones, method, jobs)
         
         # Save the processed audio
         print(f"Saving processed audio to: {output_file}")
-        sf.write(output_file, y_shifted, sr)
+        # 16-bit PCM, clipped first since libsndfile does not clip out-of-range floats by default
+        np.clip(y_shifted, -1.0, 1.0, out=y_shifted)
+        sf.write(output_file, y_shifted, sr, subtype='PCM_16')
         
         print("✓ Professional pitch shifting completed successfully!")
         print(f"✓ Method used: {method}")
@@ -187,6 +359,8 @@ def interactive_mode():
     methods = ['librosa']
     if RUBBERBAND_AVAILABLE:
         methods.append('rubberband')
+    if TORCH_AVAILABLE:
+        methods.append('torch')
     
     print(f"Available methods: {', '.join(methods)}")
     method = input(f"Choose method ({'/'.join(methods)}) [librosa]: ").strip().lower()
@@ -207,6 +381,7 @@ def main():
 Methods:
   librosa     - High-quality phase vocoder (recommended for BLE audio)
   rubberband  - Professional DAW-quality (requires pyrubberband)
+  torch       - Phase vocoder on the GPU (requires torch + torchaudio)
 
 Examples:
   %(prog)s input.wav output.wav 2                    # Librosa method, +2 semitones
@@ -227,9 +402,13 @@ BLE Audio Processing:
     methods = ['librosa']
     if RUBBERBAND_AVAILABLE:
         methods.append('rubberband')
+    if TORCH_AVAILABLE:
+        methods.append('torch')
     
     parser.add_argument("--method", choices=methods, default='librosa',
                        help=f"Processing method (default: librosa)")
+    parser.add_argument("--jobs", type=int, default=1,
+                       help="Worker processes for long files, split into overlapping 30 s chunks (default: 1)")
     
     args = parser.parse_args()
     
@@ -242,7 +421,7 @@ BLE Audio Processing:
     # Check if all arguments are provided
     if args.input_file and args.output_file and args.semitones is not None:
         # Command line mode
-        pitch_shift_audio(args.input_file, args.output_file, args.semitones, args.method)
+        pitch_shift_audio(args.input_file, args.output_file, args.semitones, args.method, args.jobs)
     else:
         # Interactive mode
         input_file, output_file, semitones, method = interactive_mode()